@@ -1,6 +1,49 @@
+import logging
+import os
+import sys
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _is_serving() -> bool:
+    """False for management commands, and for runserver's autoreloader parent, which never serves requests."""
+    if os.path.basename(sys.argv[0]) != 'manage.py':
+        return True
+    return sys.argv[1:2] == ['runserver'] and os.environ.get('RUN_MAIN') == 'true'
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Read by PyTorch when CUDA initializes, so it has to be set before the model loads
+        os.environ.setdefault('PYTORCH_CUDA_ALLOC_CONF', settings.PYTORCH_CUDA_ALLOC_CONF)
+
+        # Requests write into these without creating them; cheap enough to do for every command
+        from .views import JOBS_DIR, OUTPUTS_DIR, UPLOADS_DIR
+        UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+        OUTPUTS_DIR.mkdir(parents=True, exist_ok=True)
+        JOBS_DIR.mkdir(parents=True, exist_ok=True)
+
+        # Load the model at startup instead of on the first request
+        if not _is_serving():
+            return
+        import torch
+        from .views import get_processor
+
+        if torch.cuda.is_available():
+            torch.cuda.set_per_process_memory_fraction(settings.CUDA_MEMORY_FRACTION / settings.SERVER_WORKERS)
+
+        try:
+            processor = get_processor()
+        except FileNotFoundError as e:
+            # Requests report the missing model themselves
+            logger.warning("Model not loaded at startup: %s", e)
+            return
+
+        # Prime the caching allocator, cuDNN plans and compiled graphs before the first request
+        if torch.cuda.is_available():
+            processor.warmup()
@@ -0,0 +1,23 @@
+"""
+Logging handlers for the API.
+"""
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+def background_stream_handler() -> QueueHandler:
+    """
+    QueueHandler whose records are written to stderr from a QueueListener thread, so logging
+    on the request path never waits on the stream.
+
+    Referenced from Django's LOGGING through the '()' key: on Python 3.12+, dictConfig treats
+    handlers declared with a QueueHandler 'class' as its own queue/listener setup. The configured
+    formatter is set on the returned handler, which formats records before they are enqueued.
+    """
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, logging.StreamHandler(), respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return QueueHandler(log_queue)
@@ -0,0 +1,29 @@
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.pdf_processor import HAS_TENSORRT, export_tensorrt
+
+
+class Command(BaseCommand):
+    help = "Export the YOLO weights at MODEL_PATH to a TensorRT engine (best.pt -> best.engine) before serving."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help="Re-export even if an engine newer than the weights exists"
+        )
+
+    def handle(self, *args, **options):
+        model_path = Path(settings.MODEL_PATH)
+        if model_path.suffix != '.pt':
+            raise CommandError(f"MODEL_PATH must point to .pt weights, got {model_path}")
+        if not HAS_TENSORRT:
+            raise CommandError("TensorRT is not installed")
+
+        try:
+            engine_path = export_tensorrt(model_path, force=options['force'])
+        except Exception as e:
+            raise CommandError(f"TensorRT export failed: {e}") from e
+
+        self.stdout.write(self.style.SUCCESS(f"TensorRT engine ready: {engine_path}"))
@@ -3,28 +3,372 @@ PDF Processing with YOLO model
 Adapted from process_pdfs_light.py
 """
 from pathlib import Path
+from functools import lru_cache, partial
+import importlib.util
 import fitz  # PyMuPDF
 from ultralytics import YOLO
 from ultralytics.engine.results import Boxes
 from PIL import Image, ImageDraw, ImageFont
-from io import BytesIO
-from typing import Dict, List, Tuple
+import logging
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import queue
+import threading
+import time
 import numpy as np
 import torch
 
+from .rasterizer import render_page
+
+logger = logging.getLogger(__name__)
+
 # Optional: OpenCV for preprocessing
 try:
     import cv2
     HAS_OPENCV = True
 except ImportError:
     HAS_OPENCV = False
-    print("Warning: opencv-python not installed. Preprocessing features will be disabled.")
+    logger.warning("opencv-python not installed. Preprocessing features will be disabled.")
+
+# Optional: CUDA-enabled OpenCV build for GPU preprocessing
+try:
+    HAS_CV_CUDA = HAS_OPENCV and cv2.cuda.getCudaEnabledDeviceCount() > 0
+except (AttributeError, cv2.error):
+    HAS_CV_CUDA = False
+
+# Optional: OpenCL device for OpenCV's transparent API (UMat), used when there is no CUDA build
+HAS_OPENCL = HAS_OPENCV and cv2.ocl.haveOpenCL()
+
+# Optional: TensorRT for exporting the model to an FP16 engine
+HAS_TENSORRT = importlib.util.find_spec('tensorrt') is not None
+
+# Inference size the detector was trained at (train_on_colab.py), a multiple of the 32px stride;
+# also the largest image side an exported TensorRT engine accepts (dynamic shapes up to this size)
+DETECTION_IMGSZ = 768
+
+# Input shapes (batch size x letterboxed page size) captured as CUDA graphs before new shapes run eagerly
+MAX_CUDA_GRAPHS = 8
+
+# Box colors (RGB): signature=red, stamp=green, qr_code=blue
+DETECTION_COLORS = {
+    0: (255, 0, 0),    # Red for signature
+    1: (0, 255, 0),    # Green for stamp
+    2: (0, 0, 255),    # Blue for qr_code
+}
+
+# 3x3 high-pass used for sharpening, kept in float32 (filter2D's native kernel type)
+SHARPEN_KERNEL = np.array([
+    [-1, -1, -1],
+    [-1,  9, -1],
+    [-1, -1, -1]
+], dtype=np.float32)
+
+# Per-thread cache of cv2.cuda filter objects (they hold scratch buffers, so they aren't shared)
+_cuda_filters = threading.local()
+
+# Number of pages sent to YOLO in a single forward pass (lower it on small GPUs)
+BATCH_SIZE = 16
+
+# Pipeline tuning: pages buffered between stages, max wait before a partial batch is run
+PIPELINE_QUEUE_SIZE = 4
+BATCH_TIMEOUT = 0.05
+
+# Pages rasterized concurrently in the shared render pool (1 renders in-process)
+NUM_RENDER_WORKERS = min(os.cpu_count() or 1, 6)
+
+# PyMuPDF is not thread-safe: every fitz call in this process (pipeline threads, count_pages) goes through this lock
+_FITZ_LOCK = threading.Lock()
+
+# Marks the end of a stage's output
+_SENTINEL = object()
+
+# Render worker processes, started on first use and shared by all requests
+_render_executor: Optional[ProcessPoolExecutor] = None
+_render_executor_lock = threading.Lock()
+
+
+class _PipelineStopped(Exception):
+    """Raised inside pipeline stages once another stage has failed."""
+
+
+def _queue_put(q: queue.Queue, item, stop: threading.Event):
+    """Put an item on a bounded queue, giving up if the pipeline is stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+    raise _PipelineStopped()
+
+
+def _queue_get(q: queue.Queue, stop: threading.Event, timeout: Optional[float] = None):
+    """Get an item from a queue; returns None if `timeout` elapses first."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not stop.is_set():
+        wait = 0.1 if deadline is None else min(0.1, max(0.0, deadline - time.monotonic()))
+        try:
+            return q.get(timeout=wait)
+        except queue.Empty:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+    raise _PipelineStopped()
+
+
+def _run_pipeline_stage(target, out_queue: queue.Queue, stop: threading.Event, errors: List[Exception]):
+    """Run one pipeline stage, then signal the next stage (or stop everything on failure)."""
+    try:
+        target()
+        _queue_put(out_queue, _SENTINEL, stop)
+    except _PipelineStopped:
+        pass
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+
+
+def _get_render_executor() -> ProcessPoolExecutor:
+    """Return the process-wide render pool; "spawn" because this process holds threads and CUDA state."""
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            _render_executor = ProcessPoolExecutor(
+                max_workers=NUM_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _render_executor
+
+
+def _discard_render_executor(executor: ProcessPoolExecutor):
+    """Drop a broken render pool (e.g. a worker crashed in MuPDF) so the next request starts a new one."""
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is executor:
+            _render_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def count_pages(pdf_bytes: bytes) -> int:
+    """Number of pages in a PDF, without rendering anything."""
+    with _FITZ_LOCK:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            return doc.page_count
+
+
+def _image_size(image: Union[Image.Image, np.ndarray]) -> Tuple[int, int]:
+    """(width, height) of a PIL image or (H, W, C) array."""
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size
+
+
+@lru_cache(maxsize=16)
+def _get_font(name: str, size: int):
+    """Load a TrueType font once per (name, size), falling back to PIL's default font."""
+    try:
+        return ImageFont.truetype(name, size)
+    except IOError:
+        return ImageFont.load_default()
+
+
+def _get_cuda_sharpen_filter():
+    """Build the CUDA sharpening filter once per thread."""
+    sharpen = getattr(_cuda_filters, 'sharpen', None)
+    if sharpen is None:
+        # CUDA linear filters take 1 or 4 channels, so the image is filtered as BGRA
+        sharpen = cv2.cuda.createLinearFilter(cv2.CV_8UC4, cv2.CV_8UC4, SHARPEN_KERNEL)
+        _cuda_filters.sharpen = sharpen
+    return sharpen
+
+
+def _map_tensors(fn, output):
+    """Apply `fn` to every tensor in a (possibly nested) model output."""
+    if isinstance(output, torch.Tensor):
+        return fn(output)
+    if isinstance(output, (list, tuple)):
+        return type(output)(_map_tensors(fn, o) for o in output)
+    return output
+
+
+def _to_float32(output):
+    """Cast floating-point tensors in a (possibly nested) model output to float32."""
+    return _map_tensors(lambda t: t.float() if t.is_floating_point() else t, output)
+
+
+class _Float32Head(torch.nn.Module):
+    """
+    Runs the Detect head outside autocast on float32 inputs, so anchors and box decoding keep
+    full precision (bfloat16 steps are 4 px at 768 px coordinates). Carries the routing
+    attributes (f, i, type) ultralytics' forward loop reads from every layer.
+    """
+
+    def __init__(self, head: torch.nn.Module):
+        super().__init__()
+        self.head = head
+        self.f, self.i, self.type = head.f, head.i, head.type
+
+    def forward(self, x):
+        with torch.autocast('cuda', enabled=False):
+            return self.head([t.float() for t in x])
+
+
+class _CompiledModel(torch.nn.Module):
+    """
+    Inference wrapper around the YOLO network: channels_last, torch.compile and,
+    when `dtype` is given, weights except the Detect head cast to that dtype with the
+    forward run under autocast. Outputs come back as float32 since ultralytics'
+    postprocessing and numpy expect it.
+
+    Compiled with dynamic shapes, so new batch sizes and page sizes reuse the same graph
+    instead of recompiling mid-request (a batch of one is still specialized).
+    """
+
+    def __init__(self, model: torch.nn.Module, dtype: Optional[torch.dtype] = None):
+        super().__init__()
+        model = model.to(memory_format=torch.channels_last)
+        if dtype is not None:
+            # Wrapped before the cast, so ultralytics' _apply leaves the head's stride and anchors alone
+            head = _Float32Head(model.model[-1])
+            model.model[-1] = head
+            model = model.to(dtype)
+            head.float()
+        self.compiled = torch.compile(model, dynamic=True, fullgraph=False)
+        self.autocast_dtype = dtype
+
+    def forward(self, im, *args, **kwargs):
+        im = im.contiguous(memory_format=torch.channels_last)
+        if self.autocast_dtype is None:
+            return self.compiled(im, *args, **kwargs)
+        with torch.autocast('cuda', dtype=self.autocast_dtype):
+            return _to_float32(self.compiled(im, *args, **kwargs))
+
+
+class _CUDAGraphModel(torch.nn.Module):
+    """
+    Inference wrapper that captures the YOLO network's forward as a CUDA graph per input
+    shape and replays it, so a batch costs one graph launch instead of one launch per kernel.
+    Graphs share one memory pool; calls with non-default arguments (augment, visualize, ...)
+    and shapes beyond MAX_CUDA_GRAPHS run eagerly.
+    """
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+        self.pool = torch.cuda.graph_pool_handle()
+        self.graphs = {}
+
+    def forward(self, im, *args, **kwargs):
+        if args or any(kwargs.values()) or not im.is_cuda:
+            return self.model(im, *args, **kwargs)
+
+        key = (tuple(im.shape), im.dtype)
+        entry = self.graphs.get(key)
+        if entry is None:
+            if len(self.graphs) >= MAX_CUDA_GRAPHS:
+                return self.model(im)
+            entry = self.graphs[key] = self._capture(im)
+
+        static_in, static_out, graph, _ = entry
+        static_in.copy_(im)
+        graph.replay()
+        # The next replay overwrites the static outputs
+        return _map_tensors(torch.Tensor.clone, static_out)
+
+    def _capture(self, im):
+        static_in = im.clone()
+
+        # Warm up on a side stream so lazy initialization (cuDNN autotuning, workspaces) stays out of the graph
+        side_stream = torch.cuda.Stream()
+        side_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(side_stream):
+            for _ in range(2):
+                self.model(static_in)
+        torch.cuda.current_stream().wait_stream(side_stream)
+
+        # Other pipeline threads keep using CUDA (e.g. cv2.cuda preprocessing) while this thread captures
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph, pool=self.pool, capture_error_mode='thread_local'):
+            static_out = self.model(static_in)
+
+        # The graph reads Detect's anchors and strides by address, but Detect replaces both whenever
+        # the input shape changes (batch size included): keep the captured ones alive with the graph
+        detect_tensors = [
+            tensor
+            for module in self.model.modules()
+            for tensor in (getattr(module, 'anchors', None), getattr(module, 'strides', None))
+            if isinstance(tensor, torch.Tensor)
+        ]
+        return static_in, static_out, graph, detect_tensors
+
+
+def export_tensorrt(model_path: Path, force: bool = False) -> Path:
+    """
+    Export a .pt model to a TensorRT engine next to it (best.pt -> best.engine) and return the engine path.
+    An engine newer than the weights is reused unless `force` is set.
+
+    FP16 only: the pinned ultralytics (8.0.206) builds TensorRT engines without INT8 calibration.
+    """
+    if not model_path.exists():
+        raise FileNotFoundError(f"Model not found: {model_path}")
+
+    engine_path = model_path.with_suffix('.engine')
+    if not force and engine_path.exists() and engine_path.stat().st_mtime >= model_path.stat().st_mtime:
+        return engine_path
+
+    export_args = {
+        'format': 'engine',
+        'half': True,
+        'dynamic': True,
+        'batch': BATCH_SIZE,
+        'imgsz': DETECTION_IMGSZ,
+    }
+
+    logger.info("🔄 Exporting %s to TensorRT...", model_path.name)
+    exported = Path(YOLO(str(model_path)).export(**export_args))
+    logger.info("✅ TensorRT engine saved to %s", exported)
+    return exported
 
 
 class PDFProcessor:
-    def __init__(self, model_path: Path):
+    def __init__(
+        self,
+        model_path: Path,
+        compile_model: bool = True,
+        use_tensorrt: bool = True
+    ):
+        # Pages render to the same few shapes, so let cuDNN pick the fastest kernels once
+        torch.backends.cudnn.benchmark = True
+        torch.set_float32_matmul_precision('high')
+
+        # Reuses an engine built offline with `manage.py export_engine`, otherwise exports one now
+        if use_tensorrt and HAS_TENSORRT and torch.cuda.is_available() and model_path.suffix == '.pt':
+            try:
+                model_path = export_tensorrt(model_path)
+            except Exception as e:
+                logger.warning("TensorRT export failed, using %s: %s", model_path.name, e)
         self.model = self._load_model(model_path)
         self.class_names = self.model.names
+        # Dynamic engines only accept batches up to the size they were exported with
+        self.max_batch_size = BATCH_SIZE if model_path.suffix == '.engine' else None
+        # One processor serves concurrent requests, and the ultralytics predictor is not thread-safe
+        self._predict_lock = threading.Lock()
+
+        # Pin size, device and precision once so pages and corner crops always hit the same
+        # letterbox and cuDNN plan; exported engines otherwise fall back to the 640 default
+        self.model.overrides['imgsz'] = DETECTION_IMGSZ
+        if torch.cuda.is_available():
+            self.model.overrides.update(device=0, half=True)
+
+        if torch.cuda.is_available():
+            if compile_model:
+                self._compile_model()
+            else:
+                self._use_cuda_graphs()
 
     def _load_model(self, model_path: Path) -> YOLO:
         if not model_path.exists():
@@ -32,15 +376,88 @@ class PDFProcessor:
         model = YOLO(str(model_path))
         return model
 
+    def _pytorch_backend(self):
+        """
+        Build the predictor and return its backend if it runs PyTorch weights, else None.
+
+        ultralytics builds its predictor lazily and casts the weights while doing so,
+        so a warm-up prediction runs first and the network is patched after.
+        """
+        self.model.predict(np.zeros((64, 64, 3), dtype=np.uint8), verbose=False)
+        backend = self.model.predictor.model
+        # Exported formats (TensorRT, ONNX, ...) are optimized by their own runtime
+        return backend if getattr(backend, 'pt', False) else None
+
+    def _compile_model(self):
+        """
+        Swap the predictor's network for a _CompiledModel (bfloat16 where the GPU supports it,
+        the FP16 weights otherwise), replayed through _CUDAGraphModel.
+
+        Not mode='reduce-overhead': its CUDA graph trees keep per-thread state created on the
+        thread that first ran the model, while inference runs on a new pipeline thread per document.
+        """
+        use_bf16 = torch.cuda.is_bf16_supported()
+        if use_bf16:
+            # The network casts itself, so the predictor keeps float32 weights and inputs
+            self.model.overrides['half'] = False
+        backend = self._pytorch_backend()
+        if backend is None:
+            return
+
+        compiled = _CompiledModel(backend.model, torch.bfloat16 if use_bf16 else None)
+        backend.model = _CUDAGraphModel(compiled)
+
+    def _use_cuda_graphs(self):
+        """Swap the predictor's (uncompiled) network for a _CUDAGraphModel."""
+        backend = self._pytorch_backend()
+        if backend is not None:
+            backend.model = _CUDAGraphModel(backend.model)
+
+    def warmup(self, batch_size: int = BATCH_SIZE):
+        """
+        Run one full batch of blank pages, then a single page (compiled separately), so the
+        first request doesn't pay for CUDA setup or compilation.
+        """
+        batch_size = min(batch_size, self.max_batch_size or batch_size)
+        page = np.zeros((1684, 1190, 3), dtype=np.uint8)  # A4 rendered at scale 2.0
+        with torch.inference_mode():
+            for size in sorted({batch_size, 1}, reverse=True):
+                self._predict([page] * size, conf_threshold=0.5, iou_threshold=0.45, max_detections=100)
+
+    def _predict(
+        self,
+        images: List,
+        conf_threshold: float,
+        iou_threshold: float,
+        max_detections: int
+    ):
+        """
+        Run YOLO on a list of images in one batched call, one Results per image.
+        Images are PIL images or BGR numpy arrays (ultralytics' convention for ndarrays).
+        """
+        with self._predict_lock:
+            return self.model.predict(
+                images,
+                conf=conf_threshold,
+                iou=iou_threshold,
+                max_det=max_detections,
+                batch=len(images),
+                verbose=False
+            )
+
+    def rgb_array_from_page(self, page: fitz.Page, scale: float = 2.0) -> np.ndarray:
+        """
+        Render a PDF page to a writable (H, W, 3) RGB array. The samples are copied once, straight
+        out of the pixmap's buffer (pix.samples would make an intermediate bytes copy).
+        """
+        matrix = fitz.Matrix(scale, scale)
+        pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csRGB, alpha=False)
+        # samples_mv points into the pixmap, so the copy has to be made while `pix` is alive
+        return np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, 3).copy()
+
     def page_to_pil(self, page: fitz.Page, scale: float = 2.0) -> Image.Image:
         """Convert a PDF page to a PIL image with a scaling factor."""
-        matrix = fitz.Matrix(scale, scale)
-        pix = page.get_pixmap(matrix=matrix, alpha=False)
-        mode = "RGB" if pix.n < 4 else "RGBA"
-        img = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
-        if mode == "RGBA":
-            img = img.convert("RGB")
-        return img
+        return Image.fromarray(self.rgb_array_from_page(page, scale))
 
     def preprocess_image(
         self,
@@ -71,84 +488,26 @@ class PDFProcessor:
 
         try:
             # Convert PIL to OpenCV format
-            img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+            img_cv = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
         except Exception as e:
-            print(f"Error converting image to OpenCV format: {e}")
+            logger.error("Error converting image to OpenCV format: %s", e)
             preprocessing_info['applied'].append(f'Error: {str(e)}')
             return image, preprocessing_info
 
         try:
-            # Store original for comparison
-            original_cv = img_cv.copy()
-
-            # 1. CLAHE - Contrast Limited Adaptive Histogram Equalization
-            # Усиливает контраст подписей, печатей и QR-кодов
-            if use_clahe:
-                print("  🔄 Applying CLAHE...")
-                # Convert to LAB color space
-                lab = cv2.cvtColor(img_cv, cv2.COLOR_BGR2LAB)
-                l, a, b = cv2.split(lab)
-
-                # Apply CLAHE to L channel - very fast operation
-                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-                l_clahe = clahe.apply(l)
-
-                # Merge channels
-                lab_clahe = cv2.merge([l_clahe, a, b])
-                img_cv = cv2.cvtColor(lab_clahe, cv2.COLOR_LAB2BGR)
-                print("  ✅ CLAHE completed")
-
-                preprocessing_info['applied'].append('CLAHE (contrast enhancement)')
-
-            # 2. Denoising - убирает шумы от сканера, пятна, помехи
-            if use_denoise:
-                print("  🔄 Applying fast denoising...")
-                # MUCH faster bilateral filter - preserves edges while removing noise
-                # Takes ~0.1-0.5 seconds instead of 30-60 seconds!
-                img_cv = cv2.bilateralFilter(
-                    img_cv,
-                    d=5,  # Diameter of pixel neighborhood (smaller = faster)
-                    sigmaColor=75,  # Filter color in color space
-                    sigmaSpace=75   # Filter in coordinate space
-                )
-                print("  ✅ Denoising completed")
-                preprocessing_info['applied'].append('Denoising (bilateral filter - fast)')
-
-            # 3. Adaptive Thresholding / Binarization
-            # Помогает QR-кодам быть лучше детектируемыми
-            if use_threshold:
-                print("  🔄 Applying adaptive thresholding...")
-                # Convert to grayscale
-                gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-
-                # Apply adaptive thresholding - very fast
-                binary = cv2.adaptiveThreshold(
-                    gray,
-                    255,
-                    cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                    cv2.THRESH_BINARY,
-                    11,  # Block size
-                    2    # Constant subtracted from mean
-                )
-
-                # Convert back to BGR for consistency
-                img_cv = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)
-                print("  ✅ Thresholding completed")
-
-                preprocessing_info['applied'].append('Thresholding (binarization)')
-
-            # Add sharpening if any preprocessing was applied
-            if len(preprocessing_info['applied']) > 0:
-                print("  🔄 Applying sharpening...")
-                # Sharpen to enhance edges - very fast
-                kernel_sharpening = np.array([
-                    [-1, -1, -1],
-                    [-1,  9, -1],
-                    [-1, -1, -1]
-                ])
-                img_cv = cv2.filter2D(img_cv, -1, kernel_sharpening)
-                print("  ✅ Sharpening completed")
-                preprocessing_info['applied'].append('Sharpening')
+            if HAS_CV_CUDA:
+                try:
+                    img_cv, applied = self._preprocess_gpu(img_cv, use_clahe, use_denoise, use_threshold)
+                except Exception as e:
+                    logger.warning("⚠️  CUDA preprocessing failed, falling back to CPU: %s", e)
+                    img_cv, applied = self._preprocess_cpu(img_cv, use_clahe, use_denoise, use_threshold)
+            elif HAS_OPENCL:
+                # Same chain on a UMat: OpenCV runs it through OpenCL with one upload and one download
+                img_umat, applied = self._preprocess_cpu(cv2.UMat(img_cv), use_clahe, use_denoise, use_threshold)
+                img_cv = img_umat.get()
+            else:
+                img_cv, applied = self._preprocess_cpu(img_cv, use_clahe, use_denoise, use_threshold)
+            preprocessing_info['applied'].extend(applied)
 
             # Convert back to PIL RGB
             img_rgb = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
@@ -159,28 +518,196 @@ class PDFProcessor:
             return processed_image, preprocessing_info
 
         except Exception as e:
-            print(f"Error during preprocessing: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error during preprocessing: %s", e)
             preprocessing_info['applied'].append(f'Error during preprocessing: {str(e)}')
             return image, preprocessing_info
 
-    def draw_detections(self, image: Image.Image, detections, class_names) -> Tuple[Image.Image, int]:
-        """Draw bounding boxes on image and return annotated image and detection count."""
+    def _preprocess_cpu(
+        self,
+        img_cv: np.ndarray,
+        use_clahe: bool,
+        use_denoise: bool,
+        use_threshold: bool
+    ) -> Tuple[np.ndarray, List[str]]:
+        """
+        Run the preprocessing chain on a BGR image on the CPU. Returns (image, applied techniques).
+        A cv2.UMat input runs the chain through OpenCL instead and comes back as a UMat.
+        """
+        applied = []
+
+        # 1. CLAHE - Contrast Limited Adaptive Histogram Equalization
+        # Усиливает контраст подписей, печатей и QR-кодов
+        if use_clahe:
+            logger.debug("🔄 Applying CLAHE...")
+            # Convert to LAB color space
+            lab = cv2.cvtColor(img_cv, cv2.COLOR_BGR2LAB)
+            l, a, b = cv2.split(lab)
+
+            # Apply CLAHE to L channel - very fast operation
+            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            l_clahe = clahe.apply(l)
+
+            # Merge channels
+            lab_clahe = cv2.merge([l_clahe, a, b])
+            img_cv = cv2.cvtColor(lab_clahe, cv2.COLOR_LAB2BGR)
+            logger.debug("✅ CLAHE completed")
+
+            applied.append('CLAHE (contrast enhancement)')
+
+        # 2. Denoising - убирает шумы от сканера, пятна, помехи
+        if use_denoise:
+            logger.debug("🔄 Applying fast denoising...")
+            # MUCH faster bilateral filter - preserves edges while removing noise
+            # Takes ~0.1-0.5 seconds instead of 30-60 seconds!
+            img_cv = cv2.bilateralFilter(
+                img_cv,
+                d=5,  # Diameter of pixel neighborhood (smaller = faster)
+                sigmaColor=75,  # Filter color in color space
+                sigmaSpace=75   # Filter in coordinate space
+            )
+            logger.debug("✅ Denoising completed")
+            applied.append('Denoising (bilateral filter - fast)')
+
+        # 3. Adaptive Thresholding / Binarization
+        # Помогает QR-кодам быть лучше детектируемыми
+        if use_threshold:
+            logger.debug("🔄 Applying adaptive thresholding...")
+            # Convert to grayscale
+            gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
+
+            # Apply adaptive thresholding - very fast
+            binary = cv2.adaptiveThreshold(
+                gray,
+                255,
+                cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                cv2.THRESH_BINARY,
+                11,  # Block size
+                2    # Constant subtracted from mean
+            )
+
+            # Convert back to BGR for consistency
+            img_cv = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)
+            logger.debug("✅ Thresholding completed")
+
+            applied.append('Thresholding (binarization)')
+
+        # Add sharpening if any preprocessing was applied
+        if applied:
+            logger.debug("🔄 Applying sharpening...")
+            # Sharpen to enhance edges - very fast
+            img_cv = cv2.filter2D(img_cv, -1, SHARPEN_KERNEL)
+            logger.debug("✅ Sharpening completed")
+            applied.append('Sharpening')
+
+        return img_cv, applied
+
+    def _preprocess_gpu(
+        self,
+        img_cv: np.ndarray,
+        use_clahe: bool,
+        use_denoise: bool,
+        use_threshold: bool
+    ) -> Tuple[np.ndarray, List[str]]:
+        """
+        Same chain as _preprocess_cpu on cv2.cuda: the image is uploaded once and
+        downloaded once. cv2.cuda has no adaptiveThreshold, so that step runs on the CPU.
+        """
+        applied = []
+        stream = cv2.cuda_Stream.Null()
+        gpu_img = cv2.cuda_GpuMat()
+        gpu_img.upload(img_cv)
+
+        # 1. CLAHE on the L channel
+        if use_clahe:
+            l, a, b = cv2.cuda.split(cv2.cuda.cvtColor(gpu_img, cv2.COLOR_BGR2LAB))
+            clahe = cv2.cuda.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+            l_clahe = clahe.apply(l, stream)
+            gpu_img = cv2.cuda.cvtColor(cv2.cuda.merge([l_clahe, a, b]), cv2.COLOR_LAB2BGR)
+            applied.append('CLAHE (contrast enhancement)')
+
+        # 2. Denoising
+        if use_denoise:
+            gpu_img = cv2.cuda.bilateralFilter(gpu_img, 5, 75, 75)
+            applied.append('Denoising (bilateral filter - fast)')
+
+        # 3. Adaptive thresholding (CPU fallback on the single-channel image)
+        if use_threshold:
+            gray = cv2.cuda.cvtColor(gpu_img, cv2.COLOR_BGR2GRAY).download()
+            binary = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+            gpu_binary = cv2.cuda_GpuMat()
+            gpu_binary.upload(binary)
+            gpu_img = cv2.cuda.cvtColor(gpu_binary, cv2.COLOR_GRAY2BGR)
+            applied.append('Thresholding (binarization)')
+
+        # Sharpening (filtered as BGRA, see _get_cuda_sharpen_filter)
+        if applied:
+            bgra = _get_cuda_sharpen_filter().apply(cv2.cuda.cvtColor(gpu_img, cv2.COLOR_BGR2BGRA))
+            gpu_img = cv2.cuda.cvtColor(bgra, cv2.COLOR_BGRA2BGR)
+            applied.append('Sharpening')
+
+        return gpu_img.download(), applied
+
+    def draw_detections(self, image: np.ndarray, detections, class_names) -> Tuple[np.ndarray, int]:
+        """Draw bounding boxes in place on an RGB array and return annotated array and detection count."""
+        if not HAS_OPENCV:
+            annotated, total_detections = self._draw_detections_pil(Image.fromarray(image), detections, class_names)
+            return np.asarray(annotated), total_detections
+
+        height, width = image.shape[:2]
+
+        # Hershey glyphs are ~22px tall at scale 1.0; match the PIL label size
+        font_face = cv2.FONT_HERSHEY_SIMPLEX
+        font_scale = max(14, width // 100) / 22
+        font_thickness = max(1, round(font_scale * 2))
+
+        total_detections = 0
+
+        for det in detections:
+            boxes = det.boxes
+            if boxes is None or len(boxes) == 0:
+                continue
+
+            # One device-to-host copy per page instead of three per box
+            # data format: [x1, y1, x2, y2, conf, cls] or [x1, y1, x2, y2, track_id, conf, cls]
+            data = boxes.data.cpu().numpy()
+
+            # Clamp all boxes to the image bounds and cast to pixel coordinates in one go
+            xyxy_all = np.clip(data[:, :4], 0, [width, height, width, height]).astype(int).tolist()
+            cls_all = data[:, -1].astype(int).tolist()
+            texts = [
+                f"{class_names.get(cls_id, f'class_{cls_id}')} {conf:.2f}"
+                for cls_id, conf in zip(cls_all, data[:, -2].tolist())
+            ]
+            text_sizes = [cv2.getTextSize(text, font_face, font_scale, font_thickness) for text in texts]
+
+            for (x1, y1, x2, y2), cls_id, text, text_size in zip(xyxy_all, cls_all, texts, text_sizes):
+                color = DETECTION_COLORS.get(cls_id, (255, 255, 0))  # Default yellow
+
+                # Draw bounding box with thicker line
+                cv2.rectangle(image, (x1, y1), (x2, y2), color, 6)
+
+                # Draw label background and text
+                (text_width, text_height), baseline = text_size
+                text_height += baseline
+
+                # Ensure label doesn't go off screen
+                label_y = max(text_height + 4, y1 - text_height - 4)
+                cv2.rectangle(image, (x1, label_y - text_height - 4), (x1 + text_width + 8, label_y), color, -1)
+                cv2.putText(
+                    image, text, (x1 + 4, label_y - 2 - baseline), font_face, font_scale,
+                    (255, 255, 255), font_thickness, cv2.LINE_AA
+                )
+
+                total_detections += 1
+
+        return image, total_detections
+
+    def _draw_detections_pil(self, image: Image.Image, detections, class_names) -> Tuple[Image.Image, int]:
+        """PIL fallback for draw_detections when OpenCV is not installed."""
         draw = ImageDraw.Draw(image)
         width, height = image.size
 
-        try:
-            font = ImageFont.truetype("arial.ttf", size=max(14, width // 100))
-        except IOError:
-            font = ImageFont.load_default()
-
-        # Color mapping: signature=red, stamp=green, qr_code=blue
-        colors = {
-            0: (255, 0, 0),    # Red for signature
-            1: (0, 255, 0),    # Green for stamp
-            2: (0, 0, 255),    # Blue for qr_code
-        }
+        font = _get_font("arial.ttf", max(14, width // 100))
 
         total_detections = 0
 
@@ -189,20 +716,13 @@ class PDFProcessor:
             if boxes is None or len(boxes) == 0:
                 continue
 
-            for i in range(len(boxes)):
-                xyxy = boxes.xyxy[i].cpu().numpy().tolist()
-                cls_id = int(boxes.cls[i].cpu().numpy())
-                conf = float(boxes.conf[i].cpu().numpy())
-                label = class_names.get(cls_id, f"class_{cls_id}")
-                color = colors.get(cls_id, (255, 255, 0))  # Default yellow
-
-                x1, y1, x2, y2 = xyxy
+            data = boxes.data.cpu().numpy()
+            xyxy_all = np.clip(data[:, :4], 0, [width, height, width, height]).tolist()
+            cls_all = data[:, -1].astype(int).tolist()
 
-                # Ensure coordinates are within image bounds
-                x1 = max(0, min(x1, width))
-                y1 = max(0, min(y1, height))
-                x2 = max(0, min(x2, width))
-                y2 = max(0, min(y2, height))
+            for (x1, y1, x2, y2), cls_id, conf in zip(xyxy_all, cls_all, data[:, -2].tolist()):
+                label = class_names.get(cls_id, f"class_{cls_id}")
+                color = DETECTION_COLORS.get(cls_id, (255, 255, 0))  # Default yellow
 
                 # Draw bounding box with thicker line
                 draw.rectangle([x1, y1, x2, y2], outline=color, width=6)
@@ -223,25 +743,40 @@ class PDFProcessor:
 
         return image, total_detections
 
-    def pil_to_pdf_page(self, image: Image.Image, target_doc: fitz.Document):
-        """Insert the PIL image as a new page in the target PDF document."""
-        img_bytes = BytesIO()
-        image.save(img_bytes, format="PNG")
-        img_bytes.seek(0)
+    def pil_to_pdf_page(self, image: Union[Image.Image, np.ndarray], target_doc: fitz.Document):
+        """Insert a PIL image or RGB array as a new page in the target PDF document."""
+        # Hand raw RGB samples to fitz directly instead of round-tripping through PNG;
+        # the image stream is stored uncompressed until the document is saved with deflate
+        if isinstance(image, np.ndarray):
+            height, width = image.shape[:2]
+            samples = np.ascontiguousarray(image).tobytes()
+        else:
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            width, height = image.size
+            samples = image.tobytes()
+        pix = fitz.Pixmap(fitz.csRGB, width, height, samples, 0)
 
-        page = target_doc.new_page(width=image.width, height=image.height)
-        page.insert_image(page.rect, stream=img_bytes.read())
+        page = target_doc.new_page(width=width, height=height)
+        page.insert_image(page.rect, pixmap=pix)
 
-    def _extract_bottom_right_corner(self, image: Image.Image, corner_size: float = 0.10) -> Tuple[Image.Image, Tuple[int, int]]:
+    def _extract_bottom_right_corner(
+        self,
+        image: Union[Image.Image, np.ndarray],
+        corner_size: float = 0.10
+    ) -> Tuple[Image.Image, Tuple[int, int]]:
         """
         Extract bottom-right corner of the image.
         Returns (corner_image, (x_offset, y_offset)) tuple.
         
         Args:
-            image: PIL Image
+            image: PIL Image or RGB array (only the corner is converted to PIL)
             corner_size: Fraction of image size to use for corner (default 0.10 = 10%)
         """
-        width, height = image.size
+        if isinstance(image, np.ndarray):
+            height, width = image.shape[:2]
+        else:
+            width, height = image.size
         corner_width = int(width * corner_size)
         corner_height = int(height * corner_size)
         
@@ -250,7 +785,10 @@ class PDFProcessor:
         y_offset = height - corner_height
         
         # Crop bottom-right corner
-        corner_image = image.crop((x_offset, y_offset, width, height))
+        if isinstance(image, np.ndarray):
+            corner_image = Image.fromarray(image[y_offset:, x_offset:])
+        else:
+            corner_image = image.crop((x_offset, y_offset, width, height))
         
         return corner_image, (x_offset, y_offset)
 
@@ -282,27 +820,14 @@ class PDFProcessor:
         if results[0].boxes is None or len(results[0].boxes) == 0:
             return results
 
-        # Get class IDs
-        classes = results[0].boxes.cls.cpu().numpy()
+        # Build the class mask on the boxes' device (no round-trip through the CPU)
+        classes = results[0].boxes.cls
+        allowed = torch.as_tensor(allowed_classes, device=classes.device, dtype=classes.dtype)
+        mask = torch.isin(classes, allowed)
 
-        # Create mask for allowed classes
-        mask = np.isin(classes, allowed_classes)
-
-        # Filter boxes
-        if mask.sum() == 0:
-            # No boxes match the filter, return empty result
-            results[0].boxes = None
-        else:
-            # Filter all box attributes by creating new Boxes object
-            # Use data tensor directly to preserve format (6 or 7 columns)
-            mask_tensor = torch.tensor(mask, device=results[0].boxes.data.device, dtype=torch.bool)
-            filtered_data = results[0].boxes.data[mask_tensor]
-            
-            # Create new Boxes object with filtered data
-            orig_shape = results[0].orig_shape
-            new_boxes = Boxes(filtered_data, orig_shape)
-            
-            results[0].boxes = new_boxes
+        # Slice the data tensor on-device to preserve its format (6 or 7 columns);
+        # no mask.any() check, an empty Boxes is handled like None downstream
+        results[0].boxes = Boxes(results[0].boxes.data[mask], results[0].orig_shape)
 
         return results
 
@@ -328,46 +853,42 @@ class PDFProcessor:
 
     def _detect_on_bottom_right_corner(
         self,
-        image: Image.Image,
+        corners: List[Tuple[Image.Image, Tuple[int, int]]],
         conf_threshold: float,
         iou_threshold: float,
-        max_detections: int,
-        corner_size: float = 0.10
-    ):
+        max_detections: int
+    ) -> List:
         """
-        Run QR code detection on bottom-right corner of the image.
-        Returns results with coordinates adjusted to full image space.
+        Run QR code detection on (preprocessed) bottom-right corners in one batched call.
+        `corners` are (corner_image, (x_offset, y_offset)) pairs from _extract_bottom_right_corner.
+        Returns per-corner results with coordinates adjusted to full image space.
         """
-        print(f"  🔲 Extracting bottom-right corner for QR detection...")
-        corner_image, (x_offset, y_offset) = self._extract_bottom_right_corner(image, corner_size)
-        print(f"  📐 Corner size: {corner_image.size}, offset: ({x_offset}, {y_offset})")
-
-        # Run detection on corner (only QR codes - class 2)
-        print(f"  🤖 Detecting QR codes in bottom-right corner...")
-        corner_results = self.model.predict(
-            corner_image,
-            conf=conf_threshold,
-            iou=iou_threshold,
-            max_det=max_detections,
-            verbose=False
+        # Run detection on corners (only QR codes - class 2)
+        logger.debug("🤖 Detecting QR codes in %d bottom-right corner(s)...", len(corners))
+        corner_results_all = self._predict(
+            [corner_image for corner_image, _ in corners],
+            conf_threshold,
+            iou_threshold,
+            max_detections
         )
 
-        # Filter for QR codes (2) only
-        corner_results = self._filter_detections_by_class(corner_results, [2])
+        adjusted_results = []
+        for corner_result, (_, (x_offset, y_offset)) in zip(corner_results_all, corners):
+            # Filter for QR codes (2) only
+            corner_results = self._filter_detections_by_class([corner_result], [2])
 
-        # Adjust coordinates to full image space
-        if corner_results[0].boxes is not None and len(corner_results[0].boxes) > 0:
-            corner_results = self._adjust_detection_coordinates(corner_results, x_offset, y_offset)
-            print(f"  ✅ Found {len(corner_results[0].boxes)} QR code(s) in corner")
-        else:
-            print(f"  ℹ️  No QR codes found in corner")
+            # Adjust coordinates to full image space
+            if corner_results[0].boxes is not None and len(corner_results[0].boxes) > 0:
+                corner_results = self._adjust_detection_coordinates(corner_results, x_offset, y_offset)
+                logger.debug("✅ Found %d QR code(s) in corner", len(corner_results[0].boxes))
+            adjusted_results.append(corner_results)
 
-        return corner_results
+        return adjusted_results
 
     def process_pdf(
         self,
         pdf_bytes: bytes,
-        output_path: Path,
+        output_path: Union[Path, BinaryIO],
         pdf_filename: str = "document.pdf",
         conf_threshold: float = 0.5,
         iou_threshold: float = 0.45,
@@ -375,24 +896,38 @@ class PDFProcessor:
         use_clahe: bool = False,
         use_denoise: bool = False,
         use_threshold: bool = False,
-        preprocessing_viz_path: Path = None
+        preprocessing_viz_path: Optional[Union[Path, BinaryIO]] = None,
+        batch_size: int = BATCH_SIZE,
+        num_workers: int = NUM_RENDER_WORKERS,
+        batch_timeout: float = BATCH_TIMEOUT
     ) -> Dict:
         """
         Process a PDF and return statistics.
 
+        Pages flow through a threaded pipeline: rasterization, preprocessing and
+        batched YOLO inference (up to `batch_size` pages per call, or whatever arrived
+        within `batch_timeout` seconds of the oldest waiting page) overlap, while
+        this thread draws detections and assembles the output PDF. When `num_workers` > 1,
+        up to that many pages are rasterized at once in the shared render process pool.
+
         If denoising or thresholding is enabled:
         - First pass: detect all objects (signatures, stamps, QR codes) on original image
         - Second pass: detect QR codes in bottom-right corner on preprocessed image (with denoising/thresholding)
         - Merge results from both passes
 
+        `output_path` and `preprocessing_viz_path` may be paths or writable binary
+        buffers (e.g. BytesIO), so callers can keep the PDFs in memory.
+
         Returns:
             dict with processing statistics
         """
-        # Open source PDF from bytes
-        source_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        output_doc = fitz.open()
-
-        total_pages = len(source_doc)
+        # Open source PDF from bytes; fitz calls on this thread also take _FITZ_LOCK, since
+        # other threads (count_pages, concurrent requests) may be using PyMuPDF meanwhile
+        with _FITZ_LOCK:
+            source_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            output_doc = fitz.open()
+            total_pages = len(source_doc)
+            page_rects = [page.rect for page in source_doc]
         total_detections = 0
         detections_per_class = {}
         page_stats = []
@@ -408,196 +943,318 @@ class PDFProcessor:
         # Create visualization document if preprocessing is used
         preprocessing_viz_doc = None
         if (use_clahe or use_denoise or use_threshold) and preprocessing_viz_path:
-            preprocessing_viz_doc = fitz.open()
-
-        for page_number in range(total_pages):
-            print(f"📄 Processing page {page_number + 1}/{total_pages}...")
-            page = source_doc[page_number]
-            # Get original page size (before scaling)
-            original_page_rect = page.rect
-            original_page_width = original_page_rect.width
-            original_page_height = original_page_rect.height
-            
-            original_image = self.page_to_pil(page, scale=2.0)
-
-            # TWO-PASS MODE: Detect all objects first, then QR codes in corner with preprocessing
-            if two_pass_mode:
-                print(f"  🔄 Two-pass detection mode activated")
-
-                # PASS 1: Detect all objects (signatures, stamps, QR codes) on ORIGINAL image
-                print(f"  🤖 Pass 1: Detecting all objects (signatures, stamps, QR codes)...")
-                results_pass1 = self.model.predict(
-                    original_image,
-                    conf=conf_threshold,
-                    iou=iou_threshold,
-                    max_det=max_detections,
-                    verbose=False
-                )
-                print(f"  ✅ Pass 1 completed")
-
-                # PASS 2: Detect QR codes in bottom-right corner on PREPROCESSED image
-                print(f"  ✨ Applying preprocessing for QR code detection...")
-                processed_image, preprocess_info = self.preprocess_image(
-                    original_image,
-                    use_clahe=use_clahe,
-                    use_denoise=use_denoise,
-                    use_threshold=use_threshold
-                )
+            with _FITZ_LOCK:
+                preprocessing_viz_doc = fitz.open()
+
+        batch_size = max(1, min(batch_size, total_pages, self.max_batch_size or batch_size))
+
+        shared_pdf = None
+
+        # Stage buffers: rasterize -> preprocess -> detect -> assemble (this thread)
+        stop = threading.Event()
+        errors = []
+        rendered_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        prepared_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        detected_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+        def render_in_process():
+            for page_number in range(total_pages):
+                with _FITZ_LOCK:
+                    page_array = self.rgb_array_from_page(source_doc[page_number], scale=2.0)
+                yield page_array
+
+        def render_in_pool():
+            # Keep at most `num_workers` pages in flight so rendered pages cannot pile up in memory
+            executor = _get_render_executor()
+            render = partial(render_page, shared_pdf.name, len(pdf_bytes), scale=2.0)
+            pending = deque()
+            next_page = 0
+            try:
+                while pending or next_page < total_pages:
+                    while next_page < total_pages and len(pending) < num_workers:
+                        pending.append(executor.submit(render, next_page))
+                        next_page += 1
+                    width, height, samples = pending.popleft().result()
+                    # A bytearray unpickles writable, so the array can be drawn on without another copy
+                    yield np.frombuffer(samples, dtype=np.uint8).reshape(height, width, 3)
+            except BrokenProcessPool:
+                _discard_render_executor(executor)
+                raise
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        def rasterize():
+            page_arrays = render_in_pool() if shared_pdf is not None else render_in_process()
+
+            for page_number, page_array in enumerate(page_arrays):
+                # YOLO reads a BGR copy; detections are drawn on the (writable) rendered array itself
+                _queue_put(rendered_queue, {
+                    'page_number': page_number,
+                    'page_rect': page_rects[page_number],
+                    'original_array': page_array,
+                    'original_image': None,
+                    'image_to_detect': np.ascontiguousarray(page_array[..., ::-1]),
+                    'processed_image': None,
+                    'preprocess_info': None,
+                    'corner': None
+                }, stop)
+
+        def preprocess():
+            while True:
+                item = _queue_get(rendered_queue, stop)
+                if item is _SENTINEL:
+                    return
+
+                # TWO-PASS MODE: the preprocessed image is only searched for QR codes in the
+                # bottom-right corner, so crop first and preprocess just the corner
+                if two_pass_mode:
+                    corner_image, corner_offset = self._extract_bottom_right_corner(item['original_array'])
+                    processed_corner, preprocess_info = self.preprocess_image(
+                        corner_image,
+                        use_clahe=use_clahe,
+                        use_denoise=use_denoise,
+                        use_threshold=use_threshold
+                    )
+                    item['corner'] = (processed_corner, corner_offset)
+                    item['preprocess_info'] = preprocess_info
+
+                    # The full page is only preprocessed for the visualization, which shows page 1 only
+                    if preprocessing_viz_doc is not None and item['page_number'] == 0:
+                        item['original_image'] = Image.fromarray(item['original_array'])
+                        item['processed_image'], _ = self.preprocess_image(
+                            item['original_image'],
+                            use_clahe=use_clahe,
+                            use_denoise=use_denoise,
+                            use_threshold=use_threshold
+                        )
 
-                # Save preprocessing info
-                if page_number == 0:
-                    preprocessing_applied = preprocess_info['applied']
-
-                # Create visualization comparison (original vs processed)
-                if preprocessing_viz_doc is not None:
-                    self._create_preprocessing_comparison(
-                        original_image,
-                        processed_image,
-                        preprocess_info,
-                        preprocessing_viz_doc,
-                        page_number + 1
+                # SINGLE-PASS MODE: CLAHE-enhanced image replaces the original for detection
+                elif use_clahe:
+                    item['original_image'] = Image.fromarray(item['original_array'])
+                    processed_image, preprocess_info = self.preprocess_image(
+                        item['original_image'],
+                        use_clahe=use_clahe,
+                        use_denoise=False,
+                        use_threshold=False
                     )
+                    item['processed_image'] = processed_image
+                    item['preprocess_info'] = preprocess_info
+                    item['image_to_detect'] = processed_image
 
-                print(f"  🤖 Pass 2: Detecting QR codes in bottom-right corner...")
+                _queue_put(prepared_queue, item, stop)
+
+        def run_batch(items):
+            logger.debug("🤖 Running YOLO detection on %d page(s)...", len(items))
+            results_pass1 = self._predict(
+                [item['image_to_detect'] for item in items],
+                conf_threshold,
+                iou_threshold,
+                max_detections
+            )
+
+            if two_pass_mode:
+                # PASS 2: Detect QR codes in bottom-right corner on PREPROCESSED images
                 results_pass2 = self._detect_on_bottom_right_corner(
-                    processed_image,
+                    [item['corner'] for item in items],
                     conf_threshold,
                     iou_threshold,
                     max_detections
                 )
-                print(f"  ✅ Pass 2 completed")
-
-                # Merge results from both passes
-                print(f"  🔀 Merging detections from both passes...")
-                results = self._merge_detections(results_pass1, results_pass2)
-                print(f"  ✅ Merge completed")
-
-            # SINGLE-PASS MODE: Standard detection (with or without CLAHE only)
+                batch_results = [
+                    self._merge_detections([result_pass1], result_pass2)
+                    for result_pass1, result_pass2 in zip(results_pass1, results_pass2)
+                ]
             else:
-                # Apply preprocessing if requested (CLAHE only in this case)
-                if use_clahe:
-                    print(f"  ✨ Applying preprocessing...")
-                    processed_image, preprocess_info = self.preprocess_image(
-                        original_image,
-                        use_clahe=use_clahe,
-                        use_denoise=False,
-                        use_threshold=False
-                    )
+                batch_results = [[result] for result in results_pass1]
+
+            for item, results in zip(items, batch_results):
+                _queue_put(detected_queue, (item, results), stop)
+
+        def detect():
+            # Grad mode is thread-local, so inference mode is entered here rather than around process_pdf
+            with torch.inference_mode():
+                batch_pages()
+
+        def batch_pages():
+            # Accumulate pages until the batch is full, the oldest page waited too long or a page of
+            # another size arrives: ultralytics letterboxes a batch of equal sizes to the smallest
+            # rectangle and a mixed one to a square, so mixing sizes would make a page's detections
+            # depend on which pages happened to share its batch
+            pending = []
+            oldest = 0.0
+            while True:
+                timeout = None
+                if pending:
+                    timeout = max(0.0, batch_timeout - (time.monotonic() - oldest))
+                item = _queue_get(prepared_queue, stop, timeout=timeout)
+
+                if item is _SENTINEL:
+                    if pending:
+                        run_batch(pending)
+                    return
+
+                if item is not None:
+                    if pending and _image_size(item['image_to_detect']) != _image_size(pending[0]['image_to_detect']):
+                        run_batch(pending)
+                        pending = []
+                    if not pending:
+                        oldest = time.monotonic()
+                    pending.append(item)
+
+                if pending and (len(pending) >= batch_size or time.monotonic() - oldest >= batch_timeout):
+                    run_batch(pending)
+                    pending = []
+
+        stages = [
+            (rasterize, rendered_queue),
+            (preprocess, prepared_queue),
+            (detect, detected_queue),
+        ]
+        threads = [
+            threading.Thread(target=_run_pipeline_stage, args=(target, out_queue, stop, errors), daemon=True)
+            for target, out_queue in stages
+        ]
 
+        try:
+            # Render workers copy the PDF out of shared memory once instead of receiving it with every page
+            if num_workers > 1 and total_pages > 1:
+                shared_pdf = shared_memory.SharedMemory(create=True, size=len(pdf_bytes))
+                shared_pdf.buf[:len(pdf_bytes)] = pdf_bytes
+
+            for thread in threads:
+                thread.start()
+
+            while True:
+                try:
+                    detected = _queue_get(detected_queue, stop)
+                except _PipelineStopped:
+                    raise errors[0] if errors else RuntimeError("PDF processing pipeline stopped")
+                if detected is _SENTINEL:
+                    break
+
+                item, results = detected
+                page_number = item['page_number']
+                logger.debug("📄 Assembling page %d/%d...", page_number + 1, total_pages)
+
+                # Get original page size (before scaling)
+                original_page_width = item['page_rect'].width
+                original_page_height = item['page_rect'].height
+
+                if item['preprocess_info'] is not None:
                     # Save preprocessing info
                     if page_number == 0:
-                        preprocessing_applied = preprocess_info['applied']
-
-                    # Create visualization comparison (original vs processed)
-                    if preprocessing_viz_doc is not None:
-                        self._create_preprocessing_comparison(
-                            original_image,
-                            processed_image,
-                            preprocess_info,
-                            preprocessing_viz_doc,
-                            page_number + 1
-                        )
-
-                    image_to_detect = processed_image
-                else:
-                    image_to_detect = original_image
-
-                # Run YOLO prediction
-                print(f"  🤖 Running YOLO detection...")
-                results = self.model.predict(
-                    image_to_detect,
-                    conf=conf_threshold,
-                    iou=iou_threshold,
-                    max_det=max_detections,
-                    verbose=False
-                )
-                print(f"  ✅ Detection completed")
-
-            # Count detections and build annotations structure
-            page_detections = 0
-            page_classes = {}
-            page_annotations = []
-            
-            # Scale factor used for image conversion
-            scale_factor = 2.0
-
-            if results[0].boxes is not None:
-                boxes = results[0].boxes
-                page_detections = len(boxes)
-                classes = boxes.cls.cpu().numpy()
-                confidences = boxes.conf.cpu().numpy()
-                xyxy_coords = boxes.xyxy.cpu().numpy()
-
-                # Category mapping: 0 -> signature, 1 -> stamp, 2 -> qr
-                category_map = {0: "signature", 1: "stamp", 2: "qr"}
-
-                for i in range(page_detections):
-                    cls_id = int(classes[i])
-                    cls_name = self.class_names.get(cls_id, f"class_{cls_id}")
-                    category = category_map.get(cls_id, f"class_{cls_id}")
-                    
-                    # Convert from xyxy (x1, y1, x2, y2) to (x, y, width, height)
-                    # Scale coordinates back to original PDF size (divide by scale_factor)
-                    x1, y1, x2, y2 = xyxy_coords[i]
-                    x = float(x1) / scale_factor
-                    y = float(y1) / scale_factor
-                    width = float(x2 - x1) / scale_factor
-                    height = float(y2 - y1) / scale_factor
-                    area = width * height
-                    
-                    # Create annotation ID
-                    annotation_id = f"annotation_{annotation_counter}"
-                    annotation_counter += 1
-                    
-                    # Create annotation object
-                    annotation_obj = {
-                        annotation_id: {
-                            "category": category,
-                            "bbox": {
-                                "x": round(x, 2),
-                                "y": round(y, 2),
-                                "width": round(width, 2),
-                                "height": round(height, 2)
-                            },
-                            "area": round(area, 3)
+                        preprocessing_applied = item['preprocess_info']['applied']
+
+                    # Create visualization comparison (original vs processed); the techniques are the
+                    # same on every page, so one illustrative comparison for page 1 is enough
+                    if preprocessing_viz_doc is not None and page_number == 0 and item['processed_image'] is not None:
+                        with _FITZ_LOCK:
+                            self._create_preprocessing_comparison(
+                                item['original_image'],
+                                item['processed_image'],
+                                item['preprocess_info'],
+                                preprocessing_viz_doc,
+                                page_number + 1
+                            )
+
+                # Count detections and build annotations structure
+                page_detections = 0
+                page_classes = {}
+                page_annotations = []
+
+                # Scale factor used for image conversion
+                scale_factor = 2.0
+
+                if results[0].boxes is not None:
+                    boxes = results[0].boxes
+                    page_detections = len(boxes)
+                    # Single device-to-host copy; columns: xyxy..., conf, cls
+                    data_cpu = boxes.data.cpu().numpy()
+                    classes = data_cpu[:, -1]
+                    confidences = data_cpu[:, -2]
+                    xyxy_coords = data_cpu[:, :4]
+
+                    # Category mapping: 0 -> signature, 1 -> stamp, 2 -> qr
+                    category_map = {0: "signature", 1: "stamp", 2: "qr"}
+
+                    for i in range(page_detections):
+                        cls_id = int(classes[i])
+                        cls_name = self.class_names.get(cls_id, f"class_{cls_id}")
+                        category = category_map.get(cls_id, f"class_{cls_id}")
+
+                        # Convert from xyxy (x1, y1, x2, y2) to (x, y, width, height)
+                        # Scale coordinates back to original PDF size (divide by scale_factor)
+                        x1, y1, x2, y2 = xyxy_coords[i]
+                        x = float(x1) / scale_factor
+                        y = float(y1) / scale_factor
+                        width = float(x2 - x1) / scale_factor
+                        height = float(y2 - y1) / scale_factor
+                        area = width * height
+
+                        # Create annotation ID
+                        annotation_id = f"annotation_{annotation_counter}"
+                        annotation_counter += 1
+
+                        # Create annotation object
+                        annotation_obj = {
+                            annotation_id: {
+                                "category": category,
+                                "bbox": {
+                                    "x": round(x, 2),
+                                    "y": round(y, 2),
+                                    "width": round(width, 2),
+                                    "height": round(height, 2)
+                                },
+                                "area": round(area, 3)
+                            }
                         }
+                        page_annotations.append(annotation_obj)
+
+                        page_classes[cls_name] = page_classes.get(cls_name, 0) + 1
+                        detections_per_class[cls_name] = detections_per_class.get(cls_name, 0) + 1
+
+                # Store page annotations in output structure
+                # Use original PDF page size (not scaled image size)
+                page_key = f"page_{page_number + 1}"
+                annotations_output[page_key] = {
+                    "annotations": page_annotations,
+                    "page_size": {
+                        "width": int(original_page_width),
+                        "height": int(original_page_height)
                     }
-                    page_annotations.append(annotation_obj)
-                    
-                    page_classes[cls_name] = page_classes.get(cls_name, 0) + 1
-                    detections_per_class[cls_name] = detections_per_class.get(cls_name, 0) + 1
-
-            # Store page annotations in output structure
-            # Use original PDF page size (not scaled image size)
-            page_key = f"page_{page_number + 1}"
-            annotations_output[page_key] = {
-                "annotations": page_annotations,
-                "page_size": {
-                    "width": int(original_page_width),
-                    "height": int(original_page_height)
                 }
-            }
-
-            # Draw detections on ORIGINAL image (not processed) for better visualization
-            annotated_image, _ = self.draw_detections(original_image, results, self.class_names)
-            self.pil_to_pdf_page(annotated_image, output_doc)
 
-            total_detections += page_detections
-            page_stats.append({
-                'page': page_number + 1,
-                'detections': page_detections,
-                'classes': page_classes
-            })
-
-        # Save output PDF
-        output_doc.save(output_path)
-        output_doc.close()
-        source_doc.close()
-
-        # Save preprocessing visualization
-        if preprocessing_viz_doc is not None:
-            preprocessing_viz_doc.save(preprocessing_viz_path)
-            preprocessing_viz_doc.close()
+                # Draw detections on ORIGINAL image (not processed) for better visualization
+                annotated_image, _ = self.draw_detections(item['original_array'], results, self.class_names)
+                with _FITZ_LOCK:
+                    self.pil_to_pdf_page(annotated_image, output_doc)
+
+                total_detections += page_detections
+                page_stats.append({
+                    'page': page_number + 1,
+                    'detections': page_detections,
+                    'classes': page_classes
+                })
+        finally:
+            stop.set()
+            for thread in threads:
+                if thread.ident is not None:  # never started if shared memory could not be allocated
+                    thread.join()
+            if shared_pdf is not None:
+                shared_pdf.close()
+                shared_pdf.unlink()
+
+        with _FITZ_LOCK:
+            # Save output PDF; pixmaps are inserted raw, so Flate-encode them once here
+            output_doc.save(output_path, deflate=True)
+            output_doc.close()
+            source_doc.close()
+
+            # Save preprocessing visualization
+            if preprocessing_viz_doc is not None:
+                preprocessing_viz_doc.save(preprocessing_viz_path, deflate=True)
+                preprocessing_viz_doc.close()
 
         # Build final output structure matching selected_annotations.json format
         final_output = {
@@ -633,8 +1290,6 @@ class PDFProcessor:
         page_num: int
     ):
         """Create a side-by-side comparison of original and preprocessed images."""
-        from PIL import ImageDraw, ImageFont
-
         # Calculate dimensions
         width = original.width
         height = original.height
@@ -648,12 +1303,8 @@ class PDFProcessor:
 
         # Draw labels
         draw = ImageDraw.Draw(comparison)
-        try:
-            title_font = ImageFont.truetype("arial.ttf", 30)
-            label_font = ImageFont.truetype("arial.ttf", 20)
-        except IOError:
-            title_font = ImageFont.load_default()
-            label_font = ImageFont.load_default()
+        title_font = _get_font("arial.ttf", 30)
+        label_font = _get_font("arial.ttf", 20)
 
         # Title
         title = f"Page {page_num} - Preprocessing Comparison"
@@ -0,0 +1,38 @@
+"""
+PDF page rasterization for worker processes.
+Only imports PyMuPDF so spawned workers start without loading torch/ultralytics.
+"""
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+import fitz  # PyMuPDF
+
+# Last document opened by this worker, keyed by the shared memory block holding its bytes
+_worker_doc: Optional[fitz.Document] = None
+_worker_doc_name: Optional[str] = None
+
+
+def _open_shared_document(shm_name: str, size: int) -> fitz.Document:
+    """Copy a PDF out of shared memory and open it, once per document per worker."""
+    global _worker_doc, _worker_doc_name
+    if _worker_doc_name != shm_name:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            pdf_bytes = bytes(shm.buf[:size])
+        finally:
+            shm.close()
+        if _worker_doc is not None:
+            _worker_doc.close()
+        _worker_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        _worker_doc_name = shm_name
+    return _worker_doc
+
+
+def render_page(shm_name: str, size: int, page_idx: int, scale: float = 2.0) -> Tuple[int, int, bytearray]:
+    """
+    Render one page of a PDF held in shared memory to raw RGB samples. Returns (width, height, samples).
+    The samples are copied once out of the pixmap, into a bytearray so the receiving side gets a writable buffer.
+    """
+    doc = _open_shared_document(shm_name, size)
+    matrix = fitz.Matrix(scale, scale)
+    pix = doc[page_idx].get_pixmap(matrix=matrix, colorspace=fitz.csRGB, alpha=False)
+    return pix.width, pix.height, bytearray(pix.samples_mv)
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .pdf_processor import BATCH_SIZE
 
 
 class PDFProcessSerializer(serializers.Serializer):
@@ -6,12 +7,16 @@ class PDFProcessSerializer(serializers.Serializer):
     confidence_threshold = serializers.FloatField(default=0.20, min_value=0.0, max_value=1.0)
     iou_threshold = serializers.FloatField(default=0.30, min_value=0.0, max_value=1.0)
     max_detections = serializers.IntegerField(default=100, min_value=1, max_value=1000)
+    batch_size = serializers.IntegerField(default=BATCH_SIZE, min_value=1, max_value=64)
 
     # Preprocessing options
     use_clahe = serializers.BooleanField(default=False, required=False)
     use_denoise = serializers.BooleanField(default=False, required=False)
     use_threshold = serializers.BooleanField(default=False, required=False)
 
+    # Keep a copy of the uploaded PDF under media/ (the frontend shows it next to the output)
+    archive_input = serializers.BooleanField(default=True, required=False)
+
     def validate_pdf_file(self, value):
         if not value.name.endswith('.pdf'):
             raise serializers.ValidationError("Only PDF files are allowed.")
@@ -3,4 +3,5 @@ from . import views
 
 urlpatterns = [
     path('process-pdf/', views.ProcessPDFView.as_view(), name='process-pdf'),
+    path('jobs/<slug:job_id>/', views.JobStatusView.as_view(), name='job-status'),
 ]
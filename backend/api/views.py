@@ -1,144 +1,370 @@
-from rest_framework.views import APIView
+from adrf.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.conf import settings
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.urls import reverse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
 from pathlib import Path
+from typing import Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
 import os
-import uuid
+import secrets
+import threading
+import time
+import aiofiles
+import aiofiles.os
 from .serializers import PDFProcessSerializer
-from .pdf_processor import PDFProcessor
+from .pdf_processor import BATCH_SIZE, PDFProcessor, count_pages
 
+logger = logging.getLogger(__name__)
 
-class ProcessPDFView(APIView):
-    parser_classes = (MultiPartParser, FormParser)
+# Created once at startup (see ApiConfig.ready) rather than on every request
+UPLOADS_DIR = Path(settings.MEDIA_ROOT) / 'uploads'
+OUTPUTS_DIR = Path(settings.MEDIA_ROOT) / 'outputs'
+JOBS_DIR = Path(settings.MEDIA_ROOT) / 'jobs'
+
+# Loaded once per process (see ApiConfig.ready) and shared by all requests
+_PROCESSOR: Optional[PDFProcessor] = None
+_PROCESSOR_LOCK = threading.Lock()
+
+# Every process_pdf call runs on this single worker thread, one document at a time, so concurrent
+# requests queue up instead of holding GPU buffers side by side
+_GPU_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gpu-worker')
+
+# Recent results, (PDF hash, filename, detection parameters) -> (output file, visualization file, report),
+# so re-uploading the same document with the same settings skips inference. Least recently used first.
+_RESULT_CACHE: 'OrderedDict[tuple, Tuple[str, Optional[str], dict]]' = OrderedDict()
+_RESULT_CACHE_LOCK = threading.Lock()
+
+# Background jobs for large PDFs (see ASYNC_JOB_MIN_PAGES) keep their state in JOBS_DIR/<job id>.json,
+# {'status': 'queued' | 'processing' | 'completed' | 'failed', plus 'result' or 'error'}, so any server
+# process can answer a poll, not only the one that accepted the upload
+
+# Job files older than this are removed whenever a job finishes (seconds)
+JOB_RETENTION = 24 * 60 * 60
+
+# Runs background jobs, each on its own event loop, so they outlive the request that submitted them.
+# Inference itself still goes through _GPU_EXECUTOR.
+_JOB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf-job')
+
+
+def get_processor() -> PDFProcessor:
+    """Return the process-wide processor, loading the model on first use."""
+    global _PROCESSOR
+    with _PROCESSOR_LOCK:
+        if _PROCESSOR is None:
+            _PROCESSOR = PDFProcessor(
+                settings.MODEL_PATH,
+                compile_model=settings.COMPILE_MODEL,
+                use_tensorrt=settings.USE_TENSORRT
+            )
+        return _PROCESSOR
+
+
+def _get_cached_result(key: tuple) -> Optional[Tuple[str, Optional[str], dict]]:
+    with _RESULT_CACHE_LOCK:
+        result = _RESULT_CACHE.get(key)
+        if result is not None:
+            _RESULT_CACHE.move_to_end(key)
+        return result
+
+
+def _cache_result(key: tuple, result: Tuple[str, Optional[str], dict]):
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[key] = result
+        _RESULT_CACHE.move_to_end(key)
+        while len(_RESULT_CACHE) > settings.RESULT_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+
+
+def _set_job(job_id: str, **fields):
+    """Update a job's state file. It is replaced atomically, so pollers never read a partial file."""
+    job = _get_job(job_id) or {}
+    job.update(fields)
+    path = JOBS_DIR / f"{job_id}.json"
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(job))
+    os.replace(tmp_path, path)
+
+    if job['status'] in ('completed', 'failed'):
+        cutoff = time.time() - JOB_RETENTION
+        for old_path in JOBS_DIR.glob("*.json"):
+            try:
+                if old_path.stat().st_mtime < cutoff:
+                    old_path.unlink()
+            except FileNotFoundError:
+                pass  # removed by another server process meanwhile
+
+
+def _get_job(job_id: str) -> Optional[dict]:
+    try:
+        return json.loads((JOBS_DIR / f"{job_id}.json").read_text())
+    except FileNotFoundError:
+        return None
+
+
+def _result_data(
+    media_url: str,
+    input_filename: Optional[str],
+    output_filename: str,
+    preprocessing_viz_filename: Optional[str],
+    report: dict
+) -> dict:
+    """Response body of a processed PDF; media_url is the absolute MEDIA_URL of the request."""
+    response_data = {
+        'success': True,
+        'output_pdf_url': media_url + f"outputs/{output_filename}",
+        'report': report
+    }
+
+    if input_filename is not None:
+        response_data['input_pdf_url'] = media_url + f"uploads/{input_filename}"
+
+    # Add preprocessing visualization URL if available
+    if preprocessing_viz_filename is not None:
+        response_data['preprocessing_viz_url'] = media_url + f"outputs/{preprocessing_viz_filename}"
+
+    return response_data
+
+
+async def _write_file(path: Path, data: bytes):
+    async with aiofiles.open(path, 'wb') as f:
+        await f.write(data)
+
+
+async def _discard_archive(archive_task: asyncio.Task, path: Path):
+    """Remove the archived copy of an upload that failed to process, once its write has finished."""
+    # Cancelling wouldn't stop the write already running in aiofiles' thread, so let it complete first
+    await asyncio.gather(archive_task, return_exceptions=True)
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.processor = None
 
-    def get_processor(self):
-        """Lazy load the processor to avoid loading model on import."""
-        if self.processor is None:
-            model_path = settings.MODEL_PATH
-            self.processor = PDFProcessor(model_path)
-        return self.processor
+class ProcessPDFView(APIView):
+    """
+    Async view (adrf dispatches sync handlers too): model loading and inference run in a
+    worker thread so the event loop keeps accepting uploads while the GPU is busy.
+    """
+    parser_classes = (MultiPartParser, FormParser)
 
-    def post(self, request, *args, **kwargs):
-        print("\n" + "="*80)
-        print("🚀 PDF PROCESSING REQUEST RECEIVED")
-        print("="*80)
+    async def post(self, request, *args, **kwargs):
+        verbose = logger.isEnabledFor(logging.DEBUG)
+        if verbose:
+            logger.debug("=" * 80)
+        logger.info("🚀 PDF processing request received")
 
         serializer = PDFProcessSerializer(data=request.data)
 
         if not serializer.is_valid():
-            print("❌ Validation failed:", serializer.errors)
+            logger.warning("❌ Validation failed: %s", serializer.errors)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         pdf_file = serializer.validated_data['pdf_file']
         conf_threshold = serializer.validated_data.get('confidence_threshold', 0.20)
         iou_threshold = serializer.validated_data.get('iou_threshold', 0.30)
         max_detections = serializer.validated_data.get('max_detections', 100)
+        batch_size = serializer.validated_data.get('batch_size', BATCH_SIZE)
 
         # Preprocessing options
         use_clahe = serializer.validated_data.get('use_clahe', False)
         use_denoise = serializer.validated_data.get('use_denoise', False)
         use_threshold = serializer.validated_data.get('use_threshold', False)
 
-        print(f"📄 File: {pdf_file.name}, Size: {pdf_file.size} bytes")
-        print(f"⚙️  Thresholds: conf={conf_threshold}, iou={iou_threshold}, max_det={max_detections}")
-        print(f"✨ Preprocessing: CLAHE={use_clahe}, Denoise={use_denoise}, Threshold={use_threshold}")
+        archive_input = serializer.validated_data.get('archive_input', True)
 
+        logger.info("📄 File: %s, Size: %d bytes", pdf_file.name, pdf_file.size)
+        logger.debug(
+            "⚙️  Thresholds: conf=%s, iou=%s, max_det=%s, batch=%s",
+            conf_threshold, iou_threshold, max_detections, batch_size
+        )
+        logger.debug("✨ Preprocessing: CLAHE=%s, Denoise=%s, Threshold=%s", use_clahe, use_denoise, use_threshold)
+
+        archive_task = None
         try:
             # Generate unique filenames
-            unique_id = uuid.uuid4().hex
+            unique_id = secrets.token_hex(16)
             input_filename = f"input_{unique_id}.pdf"
             output_filename = f"output_{unique_id}.pdf"
             preprocessing_viz_filename = f"preprocessing_{unique_id}.pdf"
 
-            # Save input file
-            input_path = default_storage.save(
-                f"uploads/{input_filename}",
-                ContentFile(pdf_file.read())
+            # Only a missing model is reported as such; other missing files are processing errors
+            try:
+                processor = await asyncio.to_thread(get_processor)
+            except FileNotFoundError as e:
+                logger.error("❌ Model file not found: %s", e)
+                return Response(
+                    {'error': f'Model file not found: {str(e)}'},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+
+            # Read the upload once (chunk by chunk, without rewinding it) and hand the bytes to the
+            # processor directly; if requested, the input copy is archived while the model runs
+            pdf_bytes = await asyncio.to_thread(b''.join, pdf_file.chunks())
+            if archive_input:
+                archive_task = asyncio.create_task(_write_file(UPLOADS_DIR / input_filename, pdf_bytes))
+
+            # Identical document (the filename is part of the report) with identical detection settings
+            pdf_hash = (await asyncio.to_thread(hashlib.sha256, pdf_bytes)).digest()
+            cache_key = (
+                pdf_hash, pdf_file.name, conf_threshold, iou_threshold, max_detections,
+                use_clahe, use_denoise, use_threshold
             )
-            input_full_path = Path(settings.MEDIA_ROOT) / input_path
-
-            # Process PDF
-            output_full_path = Path(settings.MEDIA_ROOT) / "outputs" / output_filename
-            output_full_path.parent.mkdir(parents=True, exist_ok=True)
-
-            # Preprocessing visualization path
-            preprocessing_viz_path = None
-            if use_clahe or use_denoise or use_threshold:
-                preprocessing_viz_path = Path(settings.MEDIA_ROOT) / "outputs" / preprocessing_viz_filename
-
-            # Read input PDF bytes
-            with open(input_full_path, 'rb') as f:
-                pdf_bytes = f.read()
-
-            # Get processor and process PDF
-            print("🔄 Loading YOLO model...")
-            processor = self.get_processor()
-            print("✅ Model loaded successfully")
-
-            print("🔄 Processing PDF...")
-            report = processor.process_pdf(
-                pdf_bytes,
-                output_full_path,
+            cached = _get_cached_result(cache_key)
+            if cached is not None and not await aiofiles.os.path.exists(OUTPUTS_DIR / cached[0]):
+                cached = None
+
+            media_url = request.build_absolute_uri(settings.MEDIA_URL)
+            archived_filename = input_filename if archive_input else None
+
+            if cached is not None:
+                logger.info("♻️  Reusing the result of an identical earlier request")
+                if archive_task is not None:
+                    await archive_task
+                return Response(_result_data(media_url, archived_filename, *cached), status=status.HTTP_200_OK)
+
+            process_args = dict(
+                processor=processor,
+                pdf_bytes=pdf_bytes,
                 pdf_filename=pdf_file.name,
+                output_filename=output_filename,
+                preprocessing_viz_filename=preprocessing_viz_filename,
+                batch_size=batch_size,
                 conf_threshold=conf_threshold,
                 iou_threshold=iou_threshold,
                 max_detections=max_detections,
                 use_clahe=use_clahe,
                 use_denoise=use_denoise,
-                use_threshold=use_threshold,
-                preprocessing_viz_path=preprocessing_viz_path
+                use_threshold=use_threshold
             )
-            print("✅ PDF processed successfully")
 
-            # Generate URLs for files
-            input_url = request.build_absolute_uri(
-                settings.MEDIA_URL + input_path.replace('\\', '/')
-            )
-            output_url = request.build_absolute_uri(
-                settings.MEDIA_URL + f"outputs/{output_filename}"
-            )
+            # Large documents run as a background job so the connection doesn't stay open for the whole run
+            if settings.ASYNC_JOB_MIN_PAGES > 0:
+                total_pages = await asyncio.to_thread(count_pages, pdf_bytes)
+                if total_pages >= settings.ASYNC_JOB_MIN_PAGES:
+                    # The job runs on its own event loop, so the archive copy is finished here
+                    if archive_task is not None:
+                        await archive_task
+                    job_id = unique_id
+                    await asyncio.to_thread(_set_job, job_id, status='queued')
+                    _JOB_EXECUTOR.submit(
+                        self._run_job, job_id, media_url, archived_filename, cache_key, process_args
+                    )
+                    logger.info("📥 %s (%d pages) queued as job %s", pdf_file.name, total_pages, job_id)
+                    return Response({
+                        'success': True,
+                        'job_id': job_id,
+                        'status': 'queued',
+                        'status_url': request.build_absolute_uri(reverse('job-status', args=[job_id])),
+                        'total_pages': total_pages
+                    }, status=status.HTTP_202_ACCEPTED)
 
-            response_data = {
-                'success': True,
-                'input_pdf_url': input_url,
-                'output_pdf_url': output_url,
-                'report': report
-            }
-
-            # Add preprocessing visualization URL if available
-            if preprocessing_viz_path and preprocessing_viz_path.exists():
-                preprocessing_viz_url = request.build_absolute_uri(
-                    settings.MEDIA_URL + f"outputs/{preprocessing_viz_filename}"
-                )
-                response_data['preprocessing_viz_url'] = preprocessing_viz_url
+            output_filename, preprocessing_viz_filename, report = await self._process(
+                archive_task=archive_task, **process_args
+            )
+            if settings.RESULT_CACHE_SIZE > 0:
+                _cache_result(cache_key, (output_filename, preprocessing_viz_filename, report))
 
-            print("✅ Returning response to client")
-            print(f"📊 Total detections: {report.get('total_detections', 0)}")
-            print("="*80 + "\n")
+            logger.info("📊 %s processed, total detections: %d", pdf_file.name, report.get('total_detections', 0))
+            if verbose:
+                logger.debug("=" * 80)
 
+            response_data = _result_data(
+                media_url, archived_filename, output_filename, preprocessing_viz_filename, report
+            )
             return Response(response_data, status=status.HTTP_200_OK)
 
-        except FileNotFoundError as e:
-            print(f"❌ Model file not found: {str(e)}")
-            print("="*80 + "\n")
-            return Response(
-                {'error': f'Model file not found: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
         except Exception as e:
-            print(f"❌ Error processing PDF: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            print("="*80 + "\n")
+            logger.exception("❌ Error processing PDF: %s", e)
+            # No result refers to the archived input, so don't leave it behind
+            if archive_task is not None:
+                await _discard_archive(archive_task, UPLOADS_DIR / input_filename)
             return Response(
                 {'error': f'Error processing PDF: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+    def _run_job(self, job_id: str, media_url: str, input_filename: Optional[str], cache_key: tuple, process_args: dict):
+        """Process a queued upload on _JOB_EXECUTOR and record the outcome for JobStatusView."""
+        _set_job(job_id, status='processing')
+        try:
+            result = asyncio.run(self._process(archive_task=None, **process_args))
+        except Exception as e:
+            logger.exception("❌ Job %s: error processing PDF: %s", job_id, e)
+            if input_filename is not None:
+                (UPLOADS_DIR / input_filename).unlink(missing_ok=True)
+            _set_job(job_id, status='failed', error=f'Error processing PDF: {str(e)}')
+            return
+
+        if settings.RESULT_CACHE_SIZE > 0:
+            _cache_result(cache_key, result)
+        logger.info("📊 Job %s processed, total detections: %d", job_id, result[2].get('total_detections', 0))
+        _set_job(job_id, status='completed', result=_result_data(media_url, input_filename, *result))
+
+    async def _process(
+        self,
+        processor: PDFProcessor,
+        pdf_bytes: bytes,
+        pdf_filename: str,
+        output_filename: str,
+        preprocessing_viz_filename: str,
+        archive_task: Optional[asyncio.Task],
+        batch_size: int,
+        **detection_options
+    ) -> Tuple[str, Optional[str], dict]:
+        """
+        Run the processor on the GPU worker and write its PDFs under media/outputs.
+        Returns (output filename, visualization filename or None, report).
+        """
+        # Process PDF into memory; the files are written without blocking the event loop afterwards
+        output_buffer = BytesIO()
+
+        # Preprocessing visualization buffer
+        preprocessing_viz_buffer = None
+        if detection_options['use_clahe'] or detection_options['use_denoise'] or detection_options['use_threshold']:
+            preprocessing_viz_buffer = BytesIO()
+
+        logger.debug("🔄 Processing PDF...")
+        process = partial(
+            processor.process_pdf,
+            pdf_bytes,
+            output_buffer,
+            pdf_filename=pdf_filename,
+            preprocessing_viz_path=preprocessing_viz_buffer,
+            batch_size=batch_size,
+            batch_timeout=settings.DETECTION_BATCH_TIMEOUT,
+            **detection_options
+        )
+        report = await asyncio.get_running_loop().run_in_executor(_GPU_EXECUTOR, process)
+        logger.debug("✅ PDF processed successfully")
+
+        # The frontend loads every URL right away, so all files (including the
+        # archived input) must be on disk before responding
+        writes = [_write_file(OUTPUTS_DIR / output_filename, output_buffer.getvalue())]
+        if archive_task is not None:
+            writes.append(archive_task)
+        if preprocessing_viz_buffer is not None and preprocessing_viz_buffer.tell() > 0:
+            writes.append(_write_file(OUTPUTS_DIR / preprocessing_viz_filename, preprocessing_viz_buffer.getvalue()))
+        else:
+            preprocessing_viz_filename = None
+        await asyncio.gather(*writes)
+
+        return output_filename, preprocessing_viz_filename, report
+
+
+class JobStatusView(APIView):
+    """State of a background job started by ProcessPDFView; 'result' holds the usual response once completed."""
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = _get_job(job_id)
+        if job is None:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'job_id': job_id, **job}, status=status.HTTP_200_OK)
@@ -2,6 +2,7 @@
 Django settings for pdf_processor project.
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -24,6 +25,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'adrf',
     'corsheaders',
     'api',
 ]
@@ -58,6 +60,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'pdf_processor.wsgi.application'
+ASGI_APPLICATION = 'pdf_processor.asgi.application'
 
 # Database
 DATABASES = {
@@ -96,6 +99,9 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads up to this size stay in memory; larger ones spill to a temporary file (Django's default is 2.5 MB)
+FILE_UPLOAD_MAX_MEMORY_SIZE = 16 * 1024 * 1024
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -106,6 +112,31 @@ CORS_ALLOW_CREDENTIALS = True
 # X-Frame-Options - Allow iframes for development
 X_FRAME_OPTIONS = 'SAMEORIGIN'  # Allow same-origin iframes
 
+# Logging: the api app's records are written to stderr from a background thread (see api.log_handlers);
+# per-page and per-step progress is logged at DEBUG
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
+    'handlers': {
+        'background': {
+            '()': 'api.log_handlers.background_stream_handler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['background'],
+            'level': 'DEBUG' if DEBUG else 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_PARSER_CLASSES': [
@@ -117,3 +148,32 @@ REST_FRAMEWORK = {
 
 # Model path
 MODEL_PATH = BASE_DIR.parent / 'best.pt'
+
+# Serve a TensorRT FP16 engine built next to MODEL_PATH (best.engine) when TensorRT and a GPU are available.
+# Build it ahead of time with `python manage.py export_engine`, otherwise it is exported on first load.
+USE_TENSORRT = True
+
+# With PyTorch weights on a GPU: torch.compile the model (True) or keep it eager (False); either way its
+# forward is replayed as CUDA graphs
+COMPILE_MODEL = True
+
+# Results of recent requests kept for identical re-uploads (same PDF, filename and detection settings); 0 disables
+RESULT_CACHE_SIZE = 64
+
+# PDFs with at least this many pages are processed as background jobs: the upload returns 202 with a
+# job id to poll at /api/jobs/<id>/ instead of holding the connection open; 0 processes everything inline
+ASYNC_JOB_MIN_PAGES = 50
+
+# Longest a partial batch of pages waits for more pages before it is sent to the model (seconds)
+DETECTION_BATCH_TIMEOUT = 0.05
+
+# PyTorch CUDA caching allocator options, exported before the model loads (an existing environment
+# variable wins). Limits fragmentation when concurrent requests share the GPU.
+PYTORCH_CUDA_ALLOC_CONF = 'expandable_segments:True,max_split_size_mb:128,garbage_collection_threshold:0.8'
+
+# Share of GPU memory all server processes together may hold, split evenly between them; the allocator's
+# garbage collection threshold is relative to each process's part
+CUDA_MEMORY_FRACTION = 0.8
+
+# Number of server processes sharing the GPU. uvicorn starts WEB_CONCURRENCY workers when --workers isn't given
+SERVER_WORKERS = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
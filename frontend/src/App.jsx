@@ -7,6 +7,22 @@ import ThresholdControls from './components/ThresholdControls'
 import PreprocessingControls from './components/PreprocessingControls'
 import './App.css'
 
+// Large PDFs are processed as background jobs (HTTP 202); their status is polled at this interval
+const JOB_POLL_INTERVAL = 2000
+
+const waitForJob = async (jobId) => {
+  while (true) {
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL))
+    const { data: job } = await axios.get(`/api/jobs/${jobId}/`)
+    if (job.status === 'completed') {
+      return job.result
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Processing failed')
+    }
+  }
+}
+
 function App() {
   const [files, setFiles] = useState([])
   const [processing, setProcessing] = useState(false)
@@ -47,12 +63,18 @@ function App() {
         timeout: 300000, // 5 minutes timeout
       })
 
+      let result = response.data
+      if (response.status === 202) {
+        console.log(`⏳ File ${index + 1} queued as job ${result.job_id} (${result.total_pages} pages)`)
+        result = await waitForJob(result.job_id)
+      }
+
       console.log(`✅ File ${index + 1} completed`)
       setResults(prev => ({
         ...prev,
         [index]: {
           status: 'completed',
-          result: response.data
+          result
         }
       }))
     } catch (err) {